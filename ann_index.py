@@ -0,0 +1,191 @@
+import argparse
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from quantization import QuantizedMatrix
+
+# Rows scored per block when assigning vectors to lists, bounding temporary memory
+ASSIGN_BLOCK_ROWS = 65536
+# k-means is trained on at most this many vectors per list
+TRAINING_SAMPLES_PER_LIST = 256
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Return the index of the most similar centroid for every row"""
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _spherical_kmeans(data: np.ndarray, n_lists: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity, returning normalised centroids"""
+    centroids = data[rng.choice(len(data), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(data, centroids)
+        counts = np.bincount(assignments, minlength=n_lists)
+        order = np.argsort(assignments, kind='stable')
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        centroids[nonempty] = np.add.reduceat(data[order], starts, axis=0)
+        # Reseed empty lists with random vectors so every list stays in use
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+        centroids = _normalize(centroids).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index: a k-means coarse quantizer over the rows of an embedding matrix
+
+    A search scores only the rows in the nprobe lists whose centroids are closest to the
+    query; raising nprobe trades speed for recall, and nprobe == n_lists is exact search.
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, fingerprint: str = ""):
+        self.centroids = centroids
+        # Row indices grouped by list; list i holds order[offsets[i]:offsets[i + 1]]
+        self.order = order
+        self.offsets = offsets
+        self.fingerprint = fingerprint
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, n_lists: Optional[int] = None, iterations: int = 10,
+              fingerprint: str = "", seed: int = 0) -> 'IVFIndex':
+        """Train the quantizer on a sample of the matrix and assign every row to a list"""
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(matrix))))
+        n_lists = min(n_lists, len(matrix))
+        rng = np.random.default_rng(seed)
+
+        sample_size = min(len(matrix), n_lists * TRAINING_SAMPLES_PER_LIST)
+        sample = np.asarray(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))],
+                            dtype=np.float32)
+        centroids = _spherical_kmeans(sample, n_lists, iterations, rng)
+
+        assignments = _assign(matrix, centroids)
+        order = np.argsort(assignments, kind='stable').astype(np.int64)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists)))).astype(np.int64)
+        return cls(centroids, order, offsets, fingerprint)
+
+    def search(self, matrix, query: np.ndarray, top_k: int, nprobe: int,
+               allowed: Optional[np.ndarray] = None) -> np.ndarray:
+        """Return the row indices of the approximate top-k rows, best first
+
+        matrix is the float32 embedding matrix or a QuantizedMatrix copy of it. allowed is an
+        optional boolean mask over the rows; rows outside it are dropped before scoring.
+        """
+        nprobe = min(nprobe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        lists = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        candidates = np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+        if allowed is not None:
+            candidates = candidates[allowed[candidates]]
+        if not len(candidates):
+            return candidates
+
+        # Reading candidates in row order keeps access to a memory-mapped matrix sequential
+        candidates.sort()
+        if isinstance(matrix, QuantizedMatrix):
+            scores = matrix.score_rows(candidates, query)
+        else:
+            scores = matrix[candidates] @ query
+        top_k = min(top_k, len(candidates))
+        best = np.argpartition(scores, -top_k)[-top_k:]
+        best = best[np.argsort(scores[best])[::-1]]
+        return candidates[best]
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                     fingerprint=np.array(self.fingerprint))
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFIndex':
+        """Load a saved index; raises FileNotFoundError if there is none"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['centroids'], data['order'], data['offsets'], str(data['fingerprint']))
+
+
+def exact_search(matrix: np.ndarray, query: np.ndarray, top_k: int) -> np.ndarray:
+    """Return the row indices of the exact top-k rows, best first"""
+    scores = matrix @ query
+    top_k = min(top_k, len(scores))
+    best = np.argpartition(scores, -top_k)[-top_k:]
+    return best[np.argsort(scores[best])[::-1]]
+
+
+def evaluate_recall(matrix: np.ndarray, index: IVFIndex, queries: np.ndarray, top_k: int = 10,
+                    nprobe_values: Optional[List[int]] = None) -> List[Dict]:
+    """Measure recall@k against exact search and mean latency for each nprobe"""
+    if nprobe_values is None:
+        nprobe_values = sorted({1, 2, 4, 8, 16, 32, index.n_lists} & set(range(1, index.n_lists + 1)))
+
+    exact = [set(exact_search(matrix, query, top_k)) for query in queries]
+    started = time.perf_counter()
+    for query in queries:
+        exact_search(matrix, query, top_k)
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    report = []
+    for nprobe in nprobe_values:
+        hits = 0
+        started = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            hits += len(truth.intersection(index.search(matrix, query, top_k, nprobe)))
+        elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        report.append({"nprobe": nprobe, "recall": hits / (len(queries) * top_k),
+                       "ms_per_query": elapsed_ms, "exact_ms_per_query": exact_ms})
+    return report
+
+
+def _sample_queries(matrix: np.ndarray, n_queries: int, noise: float, rng: np.random.Generator) -> np.ndarray:
+    """Perturbed catalog vectors, a stand-in for real query embeddings"""
+    rows = np.asarray(matrix[rng.choice(len(matrix), min(n_queries, len(matrix)), replace=False)],
+                      dtype=np.float32)
+    return _normalize(rows + rng.normal(scale=noise, size=rows.shape).astype(np.float32))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report IVF recall versus exact search on the embedding store")
+    parser.add_argument("--matrix", default=None,
+                        help="embedding matrix (.npy); defaults to the current embedding store")
+    parser.add_argument("--lists", type=int, default=None, help="number of IVF lists (default sqrt(N))")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.02, help="query perturbation per dimension")
+    args = parser.parse_args()
+    if args.matrix is None:
+        # Imported here: the bot module itself imports this one
+        from beauty_expert_bot import stored_embedding_matrix_path
+        args.matrix = stored_embedding_matrix_path()
+        if args.matrix is None:
+            parser.error("No embedding store found; pass --matrix")
+
+    matrix = np.load(args.matrix, mmap_mode='r')
+    started = time.perf_counter()
+    index = IVFIndex.build(matrix, args.lists)
+    print(f"Built {index.n_lists} lists over {len(matrix)} vectors in {time.perf_counter() - started:.1f}s")
+
+    queries = _sample_queries(matrix, args.queries, args.noise, np.random.default_rng(1))
+    for row in evaluate_recall(matrix, index, queries, args.top_k):
+        print(f"nprobe={row['nprobe']:>4}  recall@{args.top_k}={row['recall']:.3f}  "
+              f"{row['ms_per_query']:.2f} ms/query (exact {row['exact_ms_per_query']:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
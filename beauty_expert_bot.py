@@ -1,39 +1,456 @@
 import openai
+import asyncio
+import glob
+import hashlib
+import itertools
 import json
-import requests
+import os
+import sqlite3
+import threading
+import time
 import numpy as np
-from typing import Dict, List, Tuple
+import tiktoken
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from inventra_client import inventra_get, iter_json_array
+from product_store import SqliteProductStore
+from ann_index import IVFIndex
+from quantization import QuantizedMatrix, rerank, top_rows
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from catalog_filters import CatalogColumns, ProductFilter
+
+PRODUCTS_PATH = "Product/getAllProducts"
+CATALOG_CHUNK_SIZE = 64 * 1024
+# Local SQLite product store; only hot fields are kept in memory
+PRODUCT_STORE_PATH = 'products.db'
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Shortened output size requested from the embedding model; None keeps the full 1536 dimensions
+EMBEDDING_DIMENSIONS = None
+# Per-request limits of the OpenAI embeddings endpoint
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+EMBEDDING_MAX_BATCH_ITEMS = 2048
+EMBEDDING_MAX_BATCH_TOKENS = 300000
+
+# Binary embedding store: a float32 .npy matrix plus a JSON sidecar with the row ids, the
+# content hash each row was embedded from and the matrix file they belong to. Every save
+# writes a new matrix file, so replacing the sidecar publishes ids and matrix together.
+EMBEDDINGS_MATRIX_PATTERN = 'embeddings_cache.gen-{generation}.npy'
+EMBEDDINGS_META_PATH = 'embeddings_cache_meta.json'
+
+# Catalogs at least this large are searched through an IVF index instead of brute force;
+# nprobe is the number of IVF lists scanned per query (higher is slower with better recall)
+ANN_MIN_PRODUCTS = 20000
+ANN_NPROBE = 8
+ANN_INDEX_PATH = 'embeddings_cache_ivf.npz'
+
+# Optional reduced-precision search copy of the embedding matrix ('float16' or 'int8'); the
+# best top_k * QUANTIZED_RERANK_FACTOR candidates are re-scored against the float32 rows
+QUANTIZED_EMBEDDINGS_PATH = 'embeddings_cache'
+QUANTIZED_RERANK_FACTOR = 4
+
+QUERY_CACHE_SIZE = 1024
+
+# Candidates taken from each of the vector and BM25 rankings before reciprocal rank fusion
+HYBRID_CANDIDATES = 20
+
+# Search queries for the concerns reported by the skin analysis
+CONCERN_DESCRIPTIONS = {
+    'acne': "products for acne-prone skin, treating breakouts and preventing new acne",
+    'blackheads': "products that unclog pores and remove blackheads",
+    'dark spots': "products for hyperpigmentation and evening skin tone",
+    'wrinkles': "anti-aging products that reduce fine lines and wrinkles",
+    'redness': "products that calm and soothe irritated, red skin",
+    'sensitivity': "gentle products for sensitive skin that won't cause irritation",
+    'eye bags': "eye creams that reduce puffiness, under-eye bags and dark circles"
+}
+# Analysis types reported by the skin analysis API that name a concern differently
+CONCERN_ALIASES = {
+    'eyebag': 'eye bags',
+    'eyebags': 'eye bags',
+    'wrinkle': 'wrinkles',
+    'blackhead': 'blackheads',
+    'dark spot': 'dark spots',
+}
+# Recommendations are precomputed for every combination of up to this many known concerns
+CONCERN_COMBINATION_MAX = 3
+
+CHAT_MODEL = "gpt-4"
+# Prompt tokens allowed per chat request; the rest of GPT-4's 8k context is left for the reply
+HISTORY_TOKEN_BUDGET = 6000
+# Leading messages that are always sent: the system prompt, the analysis prompt and its reply
+HISTORY_PINNED_MESSAGES = 3
+
+# Older turns are folded into a running summary by a cheaper model once the unsummarized
+# part of the history exceeds the trigger; the most recent messages are always kept verbatim
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_TRIGGER_TOKENS = 3000
+SUMMARY_KEEP_MESSAGES = 4
+
+# In-memory session limits; sessions beyond them are spilled to the session store
+MAX_SESSIONS = 1000
+SESSION_IDLE_TTL = 30 * 60
+SESSION_STORE_PATH = 'sessions.db'
+
+
+def stored_embedding_matrix_path() -> Optional[str]:
+    """Path of the matrix file the embedding store currently points at, or None if there is none"""
+    try:
+        with open(EMBEDDINGS_META_PATH, 'r') as f:
+            return json.load(f).get('matrix')
+    except FileNotFoundError:
+        return None
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache of query embeddings keyed by model and normalised query text"""
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, path: Optional[str] = None,
+                 model: Optional[str] = None):
+        """model, when given, is the embedding version in use; persisted entries of other versions are dropped"""
+        self.max_size = max_size
+        self.path = path
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        if path:
+            self.load()
+
+    @staticmethod
+    def _key(model: str, query: str) -> str:
+        return f"{model}\n{' '.join(query.lower().split())}"
+
+    def get(self, model: str, query: str) -> Optional[np.ndarray]:
+        """Return the cached embedding for a query, or None, updating the hit/miss counters"""
+        key = self._key(model, query)
+        embedding = self._entries.get(key)
+        if embedding is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return embedding
+
+    def put(self, model: str, query: str, embedding: np.ndarray):
+        """Store an embedding, evicting the least recently used entry when full"""
+        key = self._key(model, query)
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def load(self):
+        """Load persisted entries from path, if the file exists"""
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                for key, embedding in zip(data['keys'], data['embeddings']):
+                    model, query = str(key).split('\n', 1)
+                    # Vectors from another model or size would mix shapes in one cache
+                    if self.model is None or model == self.model:
+                        self.put(model, query, embedding)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: Could not load query embedding cache: {e}")
+
+    def save(self):
+        """Persist the entries to path, least recently used first"""
+        if not self.path or not self._entries:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, keys=np.array(list(self._entries.keys())),
+                     embeddings=np.array(list(self._entries.values()), dtype=np.float32))
+        os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@lru_cache(maxsize=4096)
+def _count_text_tokens(model: str, text: str) -> int:
+    """Count the tokens of a text for a model, memoised so each message is encoded once"""
+    return len(tiktoken.encoding_for_model(model).encode(text))
+
+
+class HistoryManager:
+    """Selects the part of a conversation that fits a chat request's token budget"""
+
+    # Per-message framing overhead and reply priming of the chat format
+    TOKENS_PER_MESSAGE = 3
+    TOKENS_PER_REPLY = 3
+
+    def __init__(self, model: str = CHAT_MODEL, token_budget: int = HISTORY_TOKEN_BUDGET,
+                 pinned_messages: int = HISTORY_PINNED_MESSAGES):
+        self.model = model
+        self.token_budget = token_budget
+        self.pinned_messages = pinned_messages
+
+    def count_message_tokens(self, message: Dict) -> int:
+        """Count the tokens a single message contributes to a request"""
+        return (self.TOKENS_PER_MESSAGE
+                + _count_text_tokens(self.model, message["role"])
+                + _count_text_tokens(self.model, message["content"] or ""))
+
+    def count_tokens(self, messages: List[Dict]) -> int:
+        """Count the prompt tokens of a list of messages"""
+        return sum(self.count_message_tokens(message) for message in messages) + self.TOKENS_PER_REPLY
+
+    def window(self, history: List[Dict], summary: Optional[str] = None, summarized: int = 0) -> List[Dict]:
+        """Return the pinned messages, the running summary and as many recent turns as fit the budget
+
+        summarized is the number of messages after the pinned ones that the summary already covers.
+        """
+        pinned = history[:self.pinned_messages]
+        if summary:
+            pinned = pinned + [self.summary_message(summary)]
+        recent = history[self.pinned_messages + summarized:]
+        if not recent:
+            return list(pinned)
+
+        # The latest message is always sent, older turns are evicted first
+        budget = self.token_budget - self.count_tokens(pinned) - self.count_message_tokens(recent[-1])
+        start = len(recent) - 1
+        while start > 0:
+            cost = self.count_message_tokens(recent[start - 1])
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 1
+
+        # Don't open the window with an assistant reply whose question was evicted
+        while start < len(recent) - 1 and recent[start]["role"] == "assistant":
+            start += 1
+
+        return pinned + recent[start:]
+
+    @staticmethod
+    def summary_message(summary: str) -> Dict:
+        """Wrap the running summary as a message for the chat request"""
+        return {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+
+class CatalogIndex:
+    """Snapshot of the product catalog and its embedding index
+
+    A snapshot is never modified once published; refreshes build a new one and swap it in.
+    """
+
+    def __init__(self, product_data: Optional[Dict] = None, embedding_ids: Optional[np.ndarray] = None,
+                 embedding_matrix: Optional[np.ndarray] = None, ann_index: Optional[IVFIndex] = None,
+                 ann_nprobe: int = ANN_NPROBE, quantized: Optional[QuantizedMatrix] = None,
+                 rerank_factor: int = QUANTIZED_RERANK_FACTOR, lexical_index: Optional[BM25Index] = None,
+                 columns: Optional[CatalogColumns] = None):
+        self.product_data = product_data or {"products": []}
+        self.products_by_id = {product.id: product for product in self.product_data.get('products', [])}
+        self.embedding_ids = embedding_ids if embedding_ids is not None else np.empty(0, dtype=object)
+        self.embedding_matrix = embedding_matrix if embedding_matrix is not None \
+            else np.empty((0, 0), dtype=np.float32)
+        self.ann_index = ann_index
+        self.ann_nprobe = ann_nprobe
+        self.quantized = quantized
+        self.rerank_factor = rerank_factor
+        # BM25 index over the same rows as the embedding matrix
+        self.lexical_index = lexical_index
+        # Price, category and ingredient columns over the same rows, for filtered searches
+        self.columns = columns
+        # Concern combination -> top products, filled in before the snapshot is published
+        self.concern_recommendations = {}
+
+    def fingerprint(self) -> str:
+        """Hash of the row ids and content hashes, identifying structures derived from the matrix"""
+        return hashlib.sha256("\n".join(
+            f"{product_id}:{self.products_by_id[product_id].text_hash}" for product_id in self.embedding_ids
+        ).encode('utf-8')).hexdigest()
+
+    def rank_rows(self, query_embedding: np.ndarray, top_k: int, allowed: Optional[np.ndarray] = None) -> np.ndarray:
+        """Return the embedding matrix rows of the top-k products for a query embedding, best first
+
+        allowed is an optional boolean mask from allowed_rows; only rows inside it are scored.
+        """
+        # Score the quantized copy when there is one, over-fetching candidates for re-ranking
+        search_matrix = self.quantized if self.quantized is not None else self.embedding_matrix
+        n_candidates = top_k * self.rerank_factor if self.quantized is not None else top_k
+        # A selective filter leaves few enough rows to score exactly, even on an ANN-sized catalog
+        rows = np.flatnonzero(allowed) if allowed is not None else None
+
+        if self.ann_index is not None and (rows is None or len(rows) >= ANN_MIN_PRODUCTS):
+            top_indices = self.ann_index.search(search_matrix, query_embedding, n_candidates, self.ann_nprobe,
+                                                allowed)
+        elif self.quantized is not None:
+            if rows is None:
+                top_indices = top_rows(self.quantized.score(query_embedding), n_candidates)
+            else:
+                top_indices = rows[top_rows(self.quantized.score_rows(rows, query_embedding), n_candidates)]
+        elif rows is not None:
+            # Only the rows that pass the filter are read and scored
+            top_indices = rows[top_rows(self.embedding_matrix[rows] @ query_embedding, top_k)]
+        else:
+            # Score the whole catalog with a single matrix-vector product
+            similarities = self.embedding_matrix @ query_embedding
+
+            # Select the top-k without sorting the full score array
+            top_indices = top_rows(similarities, top_k)
+
+        if self.quantized is not None and self.rerank_factor > 1 and len(top_indices):
+            top_indices = rerank(self.embedding_matrix, top_indices, query_embedding, top_k)
+        return top_indices[:top_k]
+
+    def lexical_rows(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, bool]:
+        """Return the BM25 top-k rows for a query and whether the best match is confident"""
+        if self.lexical_index is None:
+            return np.empty(0, dtype=np.int64), False
+        return self.lexical_index.search(query, top_k, allowed)
+
+    def allowed_rows(self, product_filter: Optional[ProductFilter]) -> Optional[np.ndarray]:
+        """Boolean mask of the rows satisfying a filter, or None when the search is unconstrained"""
+        if self.columns is None:
+            return None
+        return self.columns.mask(product_filter)
+
+    def products(self, rows: np.ndarray) -> List[Dict]:
+        """Return the products of embedding matrix rows, in order"""
+        top_products = []
+        for product_id in self.embedding_ids[rows]:
+            product = self.products_by_id.get(product_id)
+            if product is not None:
+                top_products.append(product)
+
+        return top_products
+
+    def rank(self, query_embedding: np.ndarray, top_k: int) -> List[Dict]:
+        """Return the top-k products for a query embedding"""
+        return self.products(self.rank_rows(query_embedding, top_k))
+
+    def hybrid_rank(self, query_embedding: np.ndarray, lexical_rows: np.ndarray, top_k: int,
+                    allowed: Optional[np.ndarray] = None) -> List[Dict]:
+        """Fuse the vector ranking with a BM25 ranking of the same query and return the top-k products"""
+        if not len(lexical_rows):
+            return self.products(self.rank_rows(query_embedding, top_k, allowed))
+        vector_rows = self.rank_rows(query_embedding, max(top_k, HYBRID_CANDIDATES), allowed)
+        return self.products(reciprocal_rank_fusion([vector_rows, lexical_rows], top_k))
+
 
 class BeautyExpertBot:
-    def __init__(self, api_key: str):
-        """Initialize the beauty expert bot with OpenAI API key"""
+    def __init__(self, api_key: str, query_cache_size: int = QUERY_CACHE_SIZE,
+                 query_cache_path: Optional[str] = None, history_token_budget: int = HISTORY_TOKEN_BUDGET,
+                 lazy: bool = False, test_connection: bool = True, catalog_ttl: Optional[float] = None,
+                 ann_nprobe: int = ANN_NPROBE, quantization: Optional[str] = None,
+                 rerank_factor: int = QUANTIZED_RERANK_FACTOR,
+                 embedding_dimensions: Optional[int] = EMBEDDING_DIMENSIONS):
+        """Initialize the beauty expert bot with OpenAI API key
+
+        catalog_ttl is the age in seconds after which the cached catalog is revalidated against
+        the product API with a conditional request; None keeps using the cache indefinitely.
+        ann_nprobe tunes recall of the approximate index used for catalogs of ANN_MIN_PRODUCTS or more.
+        quantization ('float16' or 'int8') searches a reduced-precision copy of the embeddings and
+        re-ranks the best top_k * rerank_factor candidates exactly; rerank_factor=1 disables re-ranking.
+        embedding_dimensions shortens product and query embeddings via the model's dimensions
+        parameter; it is part of every content hash, so vectors of different sizes never mix.
+
+        With lazy=True the constructor returns immediately and the catalog and embedding index
+        are loaded on a background thread; `ready` resolves once they are available. Until
+        then searches return no products and answers are given without product context.
+        """
+        self.embedding_dimensions = embedding_dimensions
+        # Identifies the vector space: stored vectors are only reused under the same version
+        self.embedding_version = EMBEDDING_MODEL if embedding_dimensions is None \
+            else f"{EMBEDDING_MODEL}@{embedding_dimensions}"
+
         try:
             # Initialize OpenAI client with the provided API key
             self.client = OpenAI(api_key=api_key)
+            # Per-turn calls go through the async client so they never block the event loop
+            self.async_client = AsyncOpenAI(api_key=api_key)
             
             # Test the connection with a simple embedding request
-            self._test_connection()
+            if test_connection and not lazy:
+                self._test_connection()
             
         except Exception as e:
             print(f"Warning: Error initializing OpenAI client: {e}")
             print("Please ensure you have a valid OpenAI API key")
             raise
 
-        self.conversation_history = []
-        self.current_analysis = None
-        self.product_data = self._load_product_data()
-        self.product_embeddings = {}
-        self._initialize_embeddings()
+        self.history_manager = HistoryManager(CHAT_MODEL, history_token_budget)
+        self.query_cache = QueryEmbeddingCache(query_cache_size, query_cache_path, self.embedding_version)
+        self.catalog_ttl = catalog_ttl
+        self.ann_nprobe = ann_nprobe
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.product_store = SqliteProductStore(PRODUCT_STORE_PATH)
+        # Searches read this snapshot once; refreshes build a new one and swap it in
+        self.catalog = CatalogIndex()
+        self.concern_query_embeddings = {}
+        self._refresh_lock = threading.Lock()
+        self._refresh_stop = None
+        # Conversation methods on the bot itself operate on this session
+        self.default_session = ChatSession(self)
+
+        self.ready = Future()
+        # A running future cannot be cancelled by callers that stop waiting on it
+        self.ready.set_running_or_notify_cancel()
+        if lazy:
+            threading.Thread(target=self._warm_up, args=(test_connection,),
+                             name="catalog-warm-up", daemon=True).start()
+        else:
+            self._warm_up(test_connection=False)
+
+    def _warm_up(self, test_connection: bool):
+        """Load the catalog and build the embedding index, then resolve `ready`"""
+        try:
+            if test_connection:
+                self._test_connection()
+            with self._refresh_lock:
+                self._publish_catalog(self._load_product_data())
+            self.ready.set_result(True)
+        except Exception as e:
+            print(f"Warning: Background initialization failed: {e}")
+            self.ready.set_exception(e)
+
+    @property
+    def product_data(self) -> Dict:
+        return self.catalog.product_data
+
+    @property
+    def products_by_id(self) -> Dict:
+        return self.catalog.products_by_id
+
+    @property
+    def embedding_ids(self) -> np.ndarray:
+        return self.catalog.embedding_ids
+
+    @property
+    def embedding_matrix(self) -> np.ndarray:
+        return self.catalog.embedding_matrix
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether the catalog and embedding index have finished loading"""
+        return self.ready.done() and self.ready.exception() is None
+
+    async def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Wait for background initialization, returning False if it failed or timed out"""
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.ready)), timeout)
+        except Exception:
+            return False
+        return True
 
     def _test_connection(self):
         """Test the OpenAI connection with a simple request"""
         try:
             # Try a simple embedding request to verify the connection
             response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input="test"
+                input="test",
+                **self._embedding_options()
             )
             print("Successfully connected to OpenAI API")
         except Exception as e:
@@ -45,102 +462,464 @@ class BeautyExpertBot:
         try:
             # First try to load from local cache if exists
             try:
-                with open('product_cache.json', 'r') as f:
-                    return json.load(f)
+                data = {"products": self.product_store.load(self._product_hash, self.embedding_version)}
+                if not self._catalog_is_stale():
+                    return data
+                # Revalidate a stale cache; keep it if unchanged or the API is unreachable
+                try:
+                    return self._fetch_product_data(conditional=True) or data
+                except Exception as e:
+                    print(f"Warning: Could not revalidate product data, using cached catalog: {e}")
+                    return data
             except FileNotFoundError:
                 pass
 
             # If no cache, fetch from API
-            response = requests.get("https://api.inventra.ca/api/Product/getAllProducts")
-            if response.status_code == 200:
-                data = response.json()
-                # Cache the data for future use
-                with open('product_cache.json', 'w') as f:
-                    json.dump(data, f)
-                return data
-            return {"products": []}
+            return self._fetch_product_data() or {"products": []}
         except Exception as e:
             print(f"Warning: Could not load product data: {e}")
             return {"products": []}
 
-    def _initialize_embeddings(self):
-        """Initialize embeddings for all products"""
-        try:
-            # Try to load cached embeddings
+    def _fetch_product_data(self, conditional: bool = False) -> Optional[Dict]:
+        """Download the catalog and cache it; returns None if unchanged (304) or unavailable
+
+        A conditional request sends the validators saved from the previous response, so an
+        unchanged catalog costs neither the download nor the parse. The new validators are
+        returned under 'catalog_meta' and only saved by _publish_catalog once the catalog is live.
+        """
+        meta = self._load_catalog_meta()
+        headers = {}
+        if conditional:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        with inventra_get(PRODUCTS_PATH, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                meta['fetched_at'] = time.time()
+                self._save_catalog_meta(meta)
+                return None
+            if response.status_code != 200:
+                print(f"Warning: Product API returned status {response.status_code}")
+                return None
+
+            # Parse products one at a time as the body arrives, upserting them into the store
+            # straight away, so the raw payload is never held in memory
+            response.encoding = response.encoding or 'utf-8'
+            chunks = response.iter_content(chunk_size=CATALOG_CHUNK_SIZE, decode_unicode=True)
+            products = self.product_store.write(iter_json_array(chunks, key='products'), self._product_hash,
+                                                self.embedding_version)
+
+        return {"products": products, "catalog_meta": {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time()
+        }}
+
+    def _catalog_is_stale(self) -> bool:
+        """Whether the cached catalog is older than catalog_ttl"""
+        if self.catalog_ttl is None:
+            return False
+        fetched_at = self._load_catalog_meta().get('fetched_at', 0)
+        return time.time() - fetched_at >= self.catalog_ttl
+
+    def _load_catalog_meta(self) -> Dict:
+        """HTTP validators (ETag / Last-Modified) and fetch time of the stored catalog"""
+        return json.loads(self.product_store.get_meta('catalog_fetch') or '{}')
+
+    def _save_catalog_meta(self, meta: Dict):
+        self.product_store.set_meta('catalog_fetch', json.dumps(meta))
+
+    def refresh_product_data(self, force: bool = False) -> bool:
+        """Revalidate the catalog once it is older than catalog_ttl, returning True if it changed
+
+        The new catalog and index are built off to the side and swapped in with a single
+        assignment, so searches already in flight finish on the previous snapshot.
+        """
+        with self._refresh_lock:
+            if not force and not self._catalog_is_stale():
+                return False
             try:
-                with open('embeddings_cache.json', 'r') as f:
-                    self.product_embeddings = json.load(f)
-                return
-            except FileNotFoundError:
-                pass
+                data = self._fetch_product_data(conditional=True)
+            except Exception as e:
+                print(f"Warning: Could not refresh product data: {e}")
+                return False
+            if data is None:
+                return False
 
-            # Generate embeddings for each product
-            for product in self.product_data.get('products', []):
-                text_to_embed = f"{product['name']} {product['description']} {product['keyBenefits']} {product['activeContent']}"
-                try:
-                    response = self.client.embeddings.create(
-                        model="text-embedding-3-small",
-                        input=text_to_embed
-                    )
-                    self.product_embeddings[product['id']] = response.data[0].embedding
-                except Exception as e:
-                    print(f"Warning: Could not generate embedding for product {product['id']}: {e}")
+            return self._publish_catalog(data)
+
+    def _publish_catalog(self, product_data: Dict) -> bool:
+        """Build a snapshot and swap it in, then save the validators of the download it came from
+
+        A snapshot whose embedding index could not be built does not replace a working one, and
+        its validators are not saved, so the next revalidation downloads the catalog again.
+        Returns True if the new snapshot was published.
+        """
+        catalog_meta = product_data.pop('catalog_meta', None)
+        catalog = self._build_catalog(product_data)
+        if product_data.get('products') and not len(catalog.embedding_ids):
+            if len(self.catalog.embedding_ids):
+                print("Warning: Could not index the new catalog, keeping the previous one")
+                return False
+            # Nothing searchable is being served yet, so the products alone are still an improvement
+            self.catalog = catalog
+            return False
+
+        self.catalog = catalog
+        if catalog_meta is not None:
+            self._save_catalog_meta(catalog_meta)
+        return True
+
+    def start_auto_refresh(self, interval: float):
+        """Refresh the catalog every interval seconds on a background thread"""
+        if self._refresh_stop is not None:
+            return
+        self._refresh_stop = threading.Event()
+        threading.Thread(target=self._auto_refresh, args=(interval, self._refresh_stop),
+                         name="catalog-refresh", daemon=True).start()
+
+    def stop_auto_refresh(self):
+        """Stop the background refresher started by start_auto_refresh"""
+        if self._refresh_stop is not None:
+            self._refresh_stop.set()
+            self._refresh_stop = None
+
+    def _auto_refresh(self, interval: float, stop: threading.Event):
+        while not stop.wait(interval):
+            # Honour the TTL when one is configured, otherwise revalidate on every tick
+            if self.refresh_product_data(force=self.catalog_ttl is None):
+                print(f"Catalog refreshed: {len(self.catalog.products_by_id)} products")
+
+    def _build_catalog(self, product_data: Dict) -> 'CatalogIndex':
+        """Build a complete catalog snapshot, embedding only new or changed products"""
+        embedding_ids, embedding_matrix = self._initialize_embeddings(product_data)
+        catalog = CatalogIndex(product_data, embedding_ids, embedding_matrix)
+        if self.quantization and len(embedding_ids):
+            catalog.quantized = self._load_quantized_embeddings(catalog)
+            catalog.rerank_factor = self.rerank_factor
+        if len(embedding_ids) >= ANN_MIN_PRODUCTS:
+            catalog.ann_index = self._load_ann_index(catalog)
+            catalog.ann_nprobe = self.ann_nprobe
+        catalog.lexical_index = self._build_lexical_index(catalog)
+        catalog.columns = self._build_catalog_columns(catalog)
+        self._precompute_concern_recommendations(catalog)
+        return catalog
 
-            # Cache the embeddings
-            with open('embeddings_cache.json', 'w') as f:
-                json.dump(self.product_embeddings, f)
+    @staticmethod
+    def _build_lexical_index(catalog: 'CatalogIndex') -> Optional[BM25Index]:
+        """Build the BM25 index over the products in embedding matrix row order"""
+        try:
+            return BM25Index.build(catalog.products_by_id[product_id] for product_id in catalog.embedding_ids)
+        except Exception as e:
+            print(f"Warning: Could not build keyword index, using semantic search only: {e}")
+            return None
+
+    @staticmethod
+    def _build_catalog_columns(catalog: 'CatalogIndex') -> Optional[CatalogColumns]:
+        """Build the filter columns over the products in embedding matrix row order"""
+        try:
+            return CatalogColumns.build(catalog.products_by_id[product_id] for product_id in catalog.embedding_ids)
+        except Exception as e:
+            print(f"Warning: Could not build filter columns, searching without filters: {e}")
+            return None
+
+    def _load_quantized_embeddings(self, catalog: 'CatalogIndex') -> Optional[QuantizedMatrix]:
+        """Memory-map the quantized copy of the embeddings, rebuilding it if the embeddings changed"""
+        path = f"{QUANTIZED_EMBEDDINGS_PATH}.{self.quantization}"
+        fingerprint = catalog.fingerprint()
+        try:
+            quantized = QuantizedMatrix.load(path)
+            if quantized.fingerprint == fingerprint and quantized.kind == self.quantization:
+                return quantized
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: Could not load quantized embeddings, rebuilding: {e}")
+
+        try:
+            QuantizedMatrix.from_matrix(catalog.embedding_matrix, self.quantization, fingerprint).save(path)
+            return QuantizedMatrix.load(path)
+        except Exception as e:
+            print(f"Warning: Could not quantize embeddings, using float32: {e}")
+            return None
+
+    @staticmethod
+    def _load_ann_index(catalog: 'CatalogIndex') -> Optional[IVFIndex]:
+        """Open the persisted IVF index for this catalog, rebuilding it if the embeddings changed"""
+        fingerprint = catalog.fingerprint()
+        try:
+            index = IVFIndex.load(ANN_INDEX_PATH)
+            if index.fingerprint == fingerprint:
+                return index
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: Could not load approximate index, rebuilding: {e}")
+
+        try:
+            print(f"Building approximate index over {len(catalog.embedding_ids)} products")
+            index = IVFIndex.build(catalog.embedding_matrix, fingerprint=fingerprint)
+            tmp_path = f"{ANN_INDEX_PATH}.tmp"
+            index.save(tmp_path)
+            os.replace(tmp_path, ANN_INDEX_PATH)
+            return index
+        except Exception as e:
+            print(f"Warning: Could not build approximate index, using exact search: {e}")
+            return None
+
+    def _initialize_embeddings(self, product_data: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, matrix) embeddings for all products, embedding only new or changed ones"""
+        try:
+            products = {product.id: product for product in product_data.get('products', [])}
+            hashes = {product_id: product.text_hash for product_id, product in products.items()}
+
+            stored_ids, stored_hashes, stored_matrix = self._load_embedding_store()
+            if stored_hashes == [hashes.get(product_id) for product_id in stored_ids] \
+                    and len(stored_ids) == len(hashes):
+                # Catalog unchanged since the store was written, use the memory-mapped copy as is
+                return np.array(stored_ids, dtype=object), stored_matrix
+
+            # Reuse every stored row whose source text is unchanged; rows of deleted products are dropped
+            row_by_hash = {content_hash: row for row, content_hash in enumerate(stored_hashes)}
+            reused = {product_id: row_by_hash[content_hash] for product_id, content_hash in hashes.items()
+                      if content_hash in row_by_hash}
+            # Rows missing from the matrix may still have a valid embedding in the product store
+            stale_ids = [product_id for product_id in products if product_id not in reused]
+            new_embeddings = self.product_store.load_embeddings(stale_ids)
+
+            # Only products that are really new or changed need their full text from the store
+            stale = {product_id: self._product_text(products[product_id]) for product_id in stale_ids
+                     if product_id not in new_embeddings}
+            if stale:
+                print(f"Embedding {len(stale)} new or changed products")
+                embedded = self._embed_texts(stale)
+                self.product_store.save_embeddings(embedded)
+                new_embeddings.update(embedded)
+
+            ids = [product_id for product_id in hashes if product_id in reused or product_id in new_embeddings]
+            rows = [stored_matrix[reused[product_id]] if product_id in reused else new_embeddings[product_id]
+                    for product_id in ids]
+            matrix = np.array(rows, dtype=np.float32) if rows else np.empty((0, 0), dtype=np.float32)
+
+            # Cache the embeddings and switch to the memory-mapped copy
+            self._save_embedding_store(ids, [hashes[product_id] for product_id in ids], matrix)
+            stored_ids, _, stored_matrix = self._load_embedding_store()
+            return np.array(stored_ids, dtype=object), stored_matrix
         except Exception as e:
             print(f"Warning: Error initializing embeddings: {e}")
+            return np.empty(0, dtype=object), np.empty((0, 0), dtype=np.float32)
+
+    def _embedding_options(self) -> Dict:
+        """Model and, when configured, output dimensions for embeddings requests"""
+        if self.embedding_dimensions is None:
+            return {"model": EMBEDDING_MODEL}
+        return {"model": EMBEDDING_MODEL, "dimensions": self.embedding_dimensions}
 
-    def _get_relevant_products(self, query: str, top_k: int = 3) -> List[Dict]:
-        """Get most relevant products using semantic search"""
+    def _content_hash(self, text: str) -> str:
+        """Hash the exact embedded text together with the model and dimensions that embedded it"""
+        return hashlib.sha256(f"{self.embedding_version}\n{text}".encode('utf-8')).hexdigest()
+
+    def _load_embedding_store(self) -> Tuple[List[str], List[str], np.ndarray]:
+        """Memory-map the binary embedding store, returning (ids, hashes, matrix); empty if missing or unusable"""
+        empty = ([], [], np.empty((0, 0), dtype=np.float32))
         try:
-            # Get query embedding
-            query_response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input=query
-            )
-            query_embedding = query_response.data[0].embedding
-
-            # Calculate similarities
-            similarities = {}
-            for product_id, embedding in self.product_embeddings.items():
-                similarity = np.dot(query_embedding, embedding)
-                similarities[product_id] = similarity
-
-            # Get top-k products
-            top_products = []
-            sorted_products = sorted(similarities.items(), key=lambda x: x[1], reverse=True)
-            for product_id, _ in sorted_products[:top_k]:
-                for product in self.product_data['products']:
-                    if str(product['id']) == str(product_id):
-                        top_products.append(product)
-                        break
-
-            return top_products
+            with open(EMBEDDINGS_META_PATH, 'r') as f:
+                meta = json.load(f)
+            if 'matrix' not in meta:
+                # Written before ids and matrix were published together
+                return empty
+            # Read-only mapping: pages are shared between processes and loaded on demand
+            matrix = np.load(meta['matrix'], mmap_mode='r')
+        except FileNotFoundError:
+            return empty
+
+        if meta.get('dimensions') != self.embedding_dimensions:
+            print(f"Embedding store holds {meta.get('dimensions') or 'full'}-dimension vectors, rebuilding")
+            return empty
+
+        ids = meta.get('ids', [])
+        hashes = meta.get('hashes', [])
+        if matrix.ndim != 2 or not len(ids) == len(hashes) == matrix.shape[0]:
+            print("Warning: Embedding store is inconsistent, rebuilding")
+            return empty
+
+        return ids, hashes, matrix
+
+    def _save_embedding_store(self, ids: List[str], hashes: List[str], matrix: np.ndarray):
+        """Write the binary embedding store so readers never pair a matrix with another save's ids
+
+        The matrix goes to a new file and the sidecar naming it is replaced atomically, which is
+        the single point where the new store becomes visible. Mapped matrix files are never
+        overwritten; superseded ones are removed afterwards where the platform allows it.
+        """
+        matrix_path = EMBEDDINGS_MATRIX_PATTERN.format(generation=uuid.uuid4().hex)
+        matrix_tmp = f"{matrix_path}.tmp"
+        meta_tmp = f"{EMBEDDINGS_META_PATH}.tmp"
+        with open(matrix_tmp, 'wb') as f:
+            np.save(f, np.asarray(matrix, dtype=np.float32))
+        os.replace(matrix_tmp, matrix_path)
+        with open(meta_tmp, 'w') as f:
+            json.dump({"model": EMBEDDING_MODEL, "dimensions": self.embedding_dimensions,
+                       "matrix": matrix_path, "ids": ids, "hashes": hashes}, f)
+        os.replace(meta_tmp, EMBEDDINGS_META_PATH)
+
+        for old_path in glob.glob(EMBEDDINGS_MATRIX_PATTERN.format(generation='*')):
+            if old_path != matrix_path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    # Still mapped by a live snapshot on Windows; removed by a later save
+                    pass
+
+    @staticmethod
+    def _product_text(product: Dict) -> str:
+        """Build the text that represents a product in the embedding space"""
+        return f"{product['name']} {product['description']} {product['keyBenefits']} {product['activeContent']}"
+
+    def _product_hash(self, product: Dict) -> str:
+        """Content hash of a full product record, computed while its text is in memory"""
+        return self._content_hash(self._product_text(product))
+
+    def _embed_texts(self, texts: Dict) -> Dict:
+        """Embed a mapping of key -> text using batched requests, returning key -> embedding"""
+        embeddings = {}
+        for batch in self._batch_texts(texts):
+            keys = [key for key, _ in batch]
+            try:
+                response = self.client.embeddings.create(
+                    input=[text for _, text in batch],
+                    **self._embedding_options()
+                )
+                # Results carry the position of their input, which is not guaranteed to match order
+                for item in response.data:
+                    embeddings[keys[item.index]] = item.embedding
+            except Exception as e:
+                print(f"Warning: Could not generate embeddings for a batch of {len(keys)} texts: {e}")
+        return embeddings
+
+    def _batch_texts(self, texts: Dict) -> Iterator[List[Tuple]]:
+        """Pack (key, text) pairs into batches that fit the per-request item and token limits"""
+        encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+        batch = []
+        batch_tokens = 0
+        for key, text in texts.items():
+            tokens = encoding.encode(text)
+            if len(tokens) > EMBEDDING_MAX_INPUT_TOKENS:
+                # Overlong inputs are rejected by the API, so keep only the leading part
+                tokens = tokens[:EMBEDDING_MAX_INPUT_TOKENS]
+                text = encoding.decode(tokens)
+
+            if batch and (len(batch) >= EMBEDDING_MAX_BATCH_ITEMS
+                          or batch_tokens + len(tokens) > EMBEDDING_MAX_BATCH_TOKENS):
+                yield batch
+                batch = []
+                batch_tokens = 0
+
+            batch.append((key, text))
+            batch_tokens += len(tokens)
+
+        if batch:
+            yield batch
+
+    async def _get_relevant_products(self, query: str, top_k: int = 3,
+                                     filters: Optional[ProductFilter] = None) -> List[Dict]:
+        """Get most relevant products using hybrid keyword and semantic search
+
+        Price, category and ingredient-exclusion constraints ("under $30", "no fragrance") are
+        parsed from the query unless filters are given, and restrict the rows that are scored.
+        """
+        # Pin the current snapshot so a concurrent refresh cannot change it mid-search
+        catalog = self.catalog
+        if not len(catalog.embedding_ids):
+            return []
+        try:
+            if filters is None and catalog.columns is not None:
+                filters, search_query = catalog.columns.parse(query)
+                # A query that is nothing but constraints is still searched as written
+                query = search_query or query
+            allowed = catalog.allowed_rows(filters)
+            if allowed is not None and not allowed.any():
+                return []
+
+            lexical_rows, confident = catalog.lexical_rows(query, HYBRID_CANDIDATES, allowed)
+            if confident:
+                # A query naming a product or a distinctive ingredient needs no embedding call
+                return catalog.products(lexical_rows[:top_k])
+
+            query_embedding = await self._embed_query(query)
+            return catalog.hybrid_rank(query_embedding, lexical_rows, top_k, allowed)
         except Exception as e:
             print(f"Warning: Error in semantic search: {e}")
             return []
 
-    def _get_product_recommendations(self, skin_concerns: List[str]) -> str:
-        """Get product recommendations based on skin concerns using RAG"""
-        if not self.product_data or not self.product_data.get('products'):
-            return "I apologize, but I couldn't access the product database at the moment."
+    @staticmethod
+    def _concern_key(concern: str) -> str:
+        """Map an analysis type onto its CONCERN_DESCRIPTIONS key, e.g. 'wrinkle' -> 'wrinkles'"""
+        concern = " ".join(concern.lower().replace('_', ' ').replace('-', ' ').split())
+        return CONCERN_ALIASES.get(concern, concern)
 
-        # Create a detailed query based on skin concerns
-        concern_descriptions = {
-            'acne': "products for acne-prone skin, treating breakouts and preventing new acne",
-            'blackheads': "products that unclog pores and remove blackheads",
-            'dark spots': "products for hyperpigmentation and evening skin tone",
-            'wrinkles': "anti-aging products that reduce fine lines and wrinkles",
-            'redness': "products that calm and soothe irritated, red skin",
-            'sensitivity': "gentle products for sensitive skin that won't cause irritation"
-        }
+    @staticmethod
+    def _concern_query(concerns: frozenset) -> str:
+        """Build the search query for a set of known concerns, in a stable order"""
+        return " ".join(description for concern, description in CONCERN_DESCRIPTIONS.items()
+                        if concern in concerns)
 
-        query = " ".join([concern_descriptions.get(concern.lower(), concern) 
-                         for concern in skin_concerns])
+    def _precompute_concern_recommendations(self, catalog: 'CatalogIndex'):
+        """Embed the concern queries in one batch and rank the catalog for each concern combination"""
+        try:
+            if not self.concern_query_embeddings:
+                combinations = [frozenset(combination)
+                                for size in range(1, CONCERN_COMBINATION_MAX + 1)
+                                for combination in itertools.combinations(CONCERN_DESCRIPTIONS, size)]
+                embeddings = self._embed_texts({combination: self._concern_query(combination)
+                                                for combination in combinations})
+                self.concern_query_embeddings = {
+                    combination: np.asarray(embedding, dtype=np.float32)
+                    for combination, embedding in embeddings.items()
+                }
+
+            # Rankings depend on the catalog, so they are rebuilt with every snapshot
+            if not len(catalog.embedding_ids):
+                return
+            catalog.concern_recommendations = {
+                combination: catalog.hybrid_rank(
+                    embedding, catalog.lexical_rows(self._concern_query(combination), HYBRID_CANDIDATES)[0], 3
+                )
+                for combination, embedding in self.concern_query_embeddings.items()
+            }
+        except Exception as e:
+            print(f"Warning: Could not precompute concern recommendations: {e}")
+
+    async def _embed_query(self, query: str) -> np.ndarray:
+        """Embed a search query, serving repeated queries from the LRU cache"""
+        query_embedding = self.query_cache.get(self.embedding_version, query)
+        if query_embedding is not None:
+            return query_embedding
+
+        query_response = await self.async_client.embeddings.create(
+            input=query,
+            **self._embedding_options()
+        )
+        query_embedding = np.asarray(query_response.data[0].embedding, dtype=np.float32)
+        self.query_cache.put(self.embedding_version, query, query_embedding)
+        return query_embedding
+
+    async def _get_product_recommendations(self, skin_concerns: List[str]) -> str:
+        """Get product recommendations based on skin concerns using RAG"""
+        catalog = self.catalog
+        if not catalog.product_data or not catalog.product_data.get('products'):
+            return "I apologize, but I couldn't access the product database at the moment."
 
-        recommended_products = self._get_relevant_products(query)
+        # Standard analyses are served from the recommendations precomputed at load time
+        concern_keys = [self._concern_key(concern) for concern in skin_concerns]
+        recommended_products = catalog.concern_recommendations.get(frozenset(concern_keys))
+        if recommended_products is None:
+            # Create a detailed query based on skin concerns
+            query = " ".join([CONCERN_DESCRIPTIONS.get(concern, concern) 
+                             for concern in concern_keys])
+            recommended_products = await self._get_relevant_products(query)
 
         if not recommended_products:
             return "I couldn't find specific products matching your skin concerns in our database."
@@ -151,12 +930,12 @@ class BeautyExpertBot:
             recommendations += f"{i}. {product['name']}\n"
             recommendations += f"   Key Benefits: {product['keyBenefits']}\n"
             recommendations += f"   Active Ingredients: {product['activeContent']}\n"
-            recommendations += f"   How to Use: {product['howToUse']}\n"
+            recommendations += f"   How to Use: {product.get('howToUse', '')}\n"
             recommendations += f"   Price: ${product['price']:.2f}\n\n"
 
         return recommendations
 
-    def _format_analysis_data(self, api_data: Dict) -> str:
+    async def _format_analysis_data(self, api_data: Dict) -> str:
         """Format the API analysis data for the conversation"""
         conditions = []
         skin_concerns = []
@@ -173,15 +952,100 @@ class BeautyExpertBot:
         
         # Add product recommendations if concerns are identified
         if skin_concerns:
-            recommendations = self._get_product_recommendations(skin_concerns)
+            recommendations = await self._get_product_recommendations(skin_concerns)
             analysis_text += "\n\n" + recommendations
         
         return analysis_text
 
+    async def _stream_chat(self, messages: List[Dict]) -> AsyncIterator[str]:
+        """Stream a GPT-4 completion, yielding non-empty text deltas"""
+        stream = await self.async_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _create_system_prompt(self) -> str:
+        """Create the system prompt for the beauty expert persona"""
+        return """You are an expert dermatologist and beauty consultant with extensive experience in skincare. 
+Your role is to:
+1. Analyze skin condition measurements
+2. Provide personalized skincare advice
+3. Recommend treatments and products
+4. Answer questions about skincare concerns
+5. Give practical, actionable advice
+
+Always maintain a professional yet friendly tone. Base your recommendations on the skin analysis data provided.
+When discussing products, use the provided product information and explain why they would be beneficial.
+If asked about something not related to the analysis data, politely redirect to skin-related topics."""
+
+    @property
+    def conversation_history(self) -> List[Dict]:
+        return self.default_session.conversation_history
+
+    @property
+    def current_analysis(self) -> Optional[Dict]:
+        return self.default_session.current_analysis
+
     async def start_conversation(self, api_data: Dict) -> str:
         """Start a new conversation with initial skin analysis"""
+        return await self.default_session.start_conversation(api_data)
+
+    def stream_conversation(self, api_data: Dict) -> AsyncIterator[str]:
+        """Start a new conversation, yielding the opening message as it is generated"""
+        return self.default_session.stream_conversation(api_data)
+
+    async def get_response(self, user_message: str) -> str:
+        """Get a response from the beauty expert based on user input"""
+        return await self.default_session.get_response(user_message)
+
+    def stream_response(self, user_message: str) -> AsyncIterator[str]:
+        """Get a response from the beauty expert, yielding text deltas as they are generated"""
+        return self.default_session.stream_response(user_message)
+
+    def save_conversation(self, filename: str = None) -> str:
+        """Save the conversation history to a file"""
+        return self.default_session.save_conversation(filename)
+
+    def clear_conversation(self) -> None:
+        """Clear the current conversation history"""
+        self.default_session.clear_conversation()
+
+
+class ChatSession:
+    """Per-user conversation state; the catalog, index and API clients are shared through the bot"""
+
+    def __init__(self, bot: BeautyExpertBot, session_id: Optional[str] = None):
+        self.bot = bot
+        self.session_id = session_id or uuid.uuid4().hex
+        self.conversation_history = []
+        self.current_analysis = None
+        self.conversation_summary = None
+        self.summarized_messages = 0
+        self._compaction_task = None
+        self._turns_in_flight = 0
+
+    @property
+    def busy(self) -> bool:
+        """Whether a turn or a history compaction is still updating this session"""
+        return self._turns_in_flight > 0 or (self._compaction_task is not None and not self._compaction_task.done())
+
+    @contextmanager
+    def _turn(self):
+        """Mark a turn as in flight so the session manager does not evict it mid-turn"""
+        self._turns_in_flight += 1
+        try:
+            yield
+        finally:
+            self._turns_in_flight -= 1
+
+    async def _prepare_conversation(self, api_data: Dict) -> Tuple[str, List[Dict]]:
+        """Record the analysis and build the opening messages, returning (analysis_text, messages)"""
         self.current_analysis = api_data
-        analysis_text = self._format_analysis_data(api_data)
+        analysis_text = await self.bot._format_analysis_data(api_data)
         
         initial_prompt = f"""Based on the skin analysis results and product recommendations:
 
@@ -190,34 +1054,58 @@ class BeautyExpertBot:
 Provide a friendly introduction and initial assessment of the skin conditions. 
 Discuss the main concerns, explain the recommended products, and ask if the user would like more specific information about any of the products or their skin concerns."""
 
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": self._create_system_prompt()},
-                    {"role": "user", "content": initial_prompt}
-                ]
-            )
+        messages = [
+            {"role": "system", "content": self.bot._create_system_prompt()},
+            {"role": "user", "content": initial_prompt}
+        ]
+        return analysis_text, messages
 
-            initial_message = response.choices[0].message.content
-            self.conversation_history = [
-                {"role": "system", "content": self._create_system_prompt()},
-                {"role": "user", "content": initial_prompt},
-                {"role": "assistant", "content": initial_message}
-            ]
+    @staticmethod
+    def _conversation_fallback(analysis_text: str) -> str:
+        """Opening message used when GPT-4 is unavailable"""
+        return f"Here's your skin analysis:\n\n{analysis_text}\n\nWould you like to know more about any specific concern or product?"
+
+    async def start_conversation(self, api_data: Dict) -> str:
+        """Start a new conversation with initial skin analysis"""
+        with self._turn():
+            analysis_text, messages = await self._prepare_conversation(api_data)
+
+            try:
+                response = await self.bot.async_client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages
+                )
+
+                initial_message = response.choices[0].message.content
+                self._reset_history(messages + [{"role": "assistant", "content": initial_message}])
             
-            return initial_message
-        except Exception as e:
-            print(f"Error in GPT-4 call: {e}")
-            return f"Here's your skin analysis:\n\n{analysis_text}\n\nWould you like to know more about any specific concern or product?"
+                return initial_message
+            except Exception as e:
+                print(f"Error in GPT-4 call: {e}")
+                return self._conversation_fallback(analysis_text)
 
-    async def get_response(self, user_message: str) -> str:
-        """Get a response from the beauty expert based on user input"""
-        if not self.current_analysis:
-            return "Please start a new conversation with skin analysis data first."
+    async def stream_conversation(self, api_data: Dict) -> AsyncIterator[str]:
+        """Start a new conversation, yielding the opening message as it is generated"""
+        with self._turn():
+            analysis_text, messages = await self._prepare_conversation(api_data)
+
+            parts = []
+            try:
+                async for delta in self.bot._stream_chat(messages):
+                    parts.append(delta)
+                    yield delta
+            except Exception as e:
+                print(f"Error in GPT-4 call: {e}")
+                if not parts:
+                    yield self._conversation_fallback(analysis_text)
+                    return
+
+            self._reset_history(messages + [{"role": "assistant", "content": "".join(parts)}])
 
+    async def _prepare_user_turn(self, user_message: str) -> Tuple[List[Dict], str]:
+        """Add a user message with its product context to history, returning (relevant_products, product_context)"""
         # Get relevant product information based on user query
-        relevant_products = self._get_relevant_products(user_message)
+        relevant_products = await self.bot._get_relevant_products(user_message)
         product_context = ""
         if relevant_products:
             product_context = "Here are some relevant products for your question:\n"
@@ -226,38 +1114,113 @@ Discuss the main concerns, explain the recommended products, and ask if the user
 
         # Add user message and product context to history
         self.conversation_history.append({"role": "user", "content": f"{user_message}\n\nRelevant product information:\n{product_context}"})
+        return relevant_products, product_context
+
+    @staticmethod
+    def _response_fallback(relevant_products: List[Dict], product_context: str) -> str:
+        """Reply used when GPT-4 is unavailable"""
+        if relevant_products:
+            return f"I found some products that might help:\n\n{product_context}"
+        return "I understand your question. Let me provide a simple response based on the available data."
+
+    async def get_response(self, user_message: str) -> str:
+        """Get a response from the beauty expert based on user input"""
+        with self._turn():
+            if not self.current_analysis:
+                return "Please start a new conversation with skin analysis data first."
+
+            relevant_products, product_context = await self._prepare_user_turn(user_message)
         
-        # Get response from GPT-4
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=self.conversation_history
-            )
+            # Get response from GPT-4
+            try:
+                response = await self.bot.async_client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=self._chat_messages()
+                )
             
-            bot_response = response.choices[0].message.content
-            self.conversation_history.append({"role": "assistant", "content": bot_response})
+                bot_response = response.choices[0].message.content
+                self.conversation_history.append({"role": "assistant", "content": bot_response})
+                self._schedule_compaction()
             
-            return bot_response
+                return bot_response
 
-        except Exception as e:
-            print(f"Error in GPT-4 call: {e}")
-            if relevant_products:
-                return f"I found some products that might help:\n\n{product_context}"
-            return "I understand your question. Let me provide a simple response based on the available data."
+            except Exception as e:
+                print(f"Error in GPT-4 call: {e}")
+                return self._response_fallback(relevant_products, product_context)
 
-    def _create_system_prompt(self) -> str:
-        """Create the system prompt for the beauty expert persona"""
-        return """You are an expert dermatologist and beauty consultant with extensive experience in skincare. 
-Your role is to:
-1. Analyze skin condition measurements
-2. Provide personalized skincare advice
-3. Recommend treatments and products
-4. Answer questions about skincare concerns
-5. Give practical, actionable advice
+    async def stream_response(self, user_message: str) -> AsyncIterator[str]:
+        """Get a response from the beauty expert, yielding text deltas as they are generated"""
+        with self._turn():
+            if not self.current_analysis:
+                yield "Please start a new conversation with skin analysis data first."
+                return
 
-Always maintain a professional yet friendly tone. Base your recommendations on the skin analysis data provided.
-When discussing products, use the provided product information and explain why they would be beneficial.
-If asked about something not related to the analysis data, politely redirect to skin-related topics."""
+            relevant_products, product_context = await self._prepare_user_turn(user_message)
+
+            parts = []
+            try:
+                async for delta in self.bot._stream_chat(self._chat_messages()):
+                    parts.append(delta)
+                    yield delta
+            except Exception as e:
+                print(f"Error in GPT-4 call: {e}")
+                if not parts:
+                    yield self._response_fallback(relevant_products, product_context)
+                    return
+
+            # Record the full reply once the stream has finished
+            self.conversation_history.append({"role": "assistant", "content": "".join(parts)})
+            self._schedule_compaction()
+
+    def _reset_history(self, messages: List[Dict]):
+        """Replace the conversation history, discarding any running summary"""
+        self.conversation_history = messages
+        self.conversation_summary = None
+        self.summarized_messages = 0
+
+    def _chat_messages(self) -> List[Dict]:
+        """Build the messages for the next chat request from the history and running summary"""
+        return self.bot.history_manager.window(self.conversation_history, self.conversation_summary,
+                                           self.summarized_messages)
+
+    def _schedule_compaction(self):
+        """Start folding older turns into the summary in the background once history grows too large"""
+        if self._compaction_task is not None and not self._compaction_task.done():
+            return
+        recent = self.conversation_history[self.bot.history_manager.pinned_messages + self.summarized_messages:]
+        if len(recent) <= SUMMARY_KEEP_MESSAGES \
+                or self.bot.history_manager.count_tokens(recent) < SUMMARY_TRIGGER_TOKENS:
+            return
+        self._compaction_task = asyncio.create_task(self._compact_history())
+
+    async def _compact_history(self):
+        """Fold all but the most recent messages into the running summary using the summary model"""
+        history = self.conversation_history
+        start = self.bot.history_manager.pinned_messages + self.summarized_messages
+        end = len(history) - SUMMARY_KEEP_MESSAGES
+        if end <= start:
+            return
+
+        transcript = "\n\n".join(f"{message['role']}: {message['content']}" for message in history[start:end])
+        previous = f"Summary so far:\n{self.conversation_summary}\n\n" if self.conversation_summary else ""
+        try:
+            response = await self.bot.async_client.chat.completions.create(
+                model=SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": "You summarize skincare consultations. Keep the user's skin concerns, "
+                                                  "preferences, products discussed and advice given. Be concise."},
+                    {"role": "user", "content": f"{previous}Update the summary with these new messages:\n\n{transcript}"}
+                ]
+            )
+        except Exception as e:
+            print(f"Warning: Could not summarize conversation history: {e}")
+            return
+
+        # The conversation may have been restarted or cleared while the summary was generated
+        if self.conversation_history is not history:
+            return
+        self.conversation_summary = response.choices[0].message.content
+        self.summarized_messages = end - self.bot.history_manager.pinned_messages
 
     def save_conversation(self, filename: str = None) -> str:
         """Save the conversation history to a file"""
@@ -267,6 +1230,7 @@ If asked about something not related to the analysis data, politely redirect to
         data = {
             "timestamp": datetime.now().isoformat(),
             "skin_analysis": self.current_analysis,
+            "summary": self.conversation_summary,
             "conversation": self.conversation_history
         }
         
@@ -277,5 +1241,155 @@ If asked about something not related to the analysis data, politely redirect to
 
     def clear_conversation(self) -> None:
         """Clear the current conversation history"""
-        self.conversation_history = []
-        self.current_analysis = None 
\ No newline at end of file
+        self._reset_history([])
+        self.current_analysis = None
+
+    def to_dict(self) -> Dict:
+        """Serialize the session state for the session store"""
+        return {
+            "skin_analysis": self.current_analysis,
+            "summary": self.conversation_summary,
+            "summarized_messages": self.summarized_messages,
+            "conversation": self.conversation_history
+        }
+
+    @classmethod
+    def from_dict(cls, bot: BeautyExpertBot, session_id: str, data: Dict) -> 'ChatSession':
+        """Rebuild a session from state written by to_dict"""
+        session = cls(bot, session_id)
+        session.current_analysis = data.get("skin_analysis")
+        session.conversation_summary = data.get("summary")
+        session.summarized_messages = data.get("summarized_messages", 0)
+        session.conversation_history = data.get("conversation", [])
+        return session
+
+
+class SessionStore:
+    """SQLite-backed storage for sessions evicted from memory"""
+
+    def __init__(self, path: str = SESSION_STORE_PATH):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def save(self, session_id: str, state: Dict):
+        """Insert or replace the stored state of a session"""
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(state), time.time())
+            )
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        """Return the stored state of a session, or None"""
+        row = self._connection.execute(
+            "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, session_id: str):
+        """Remove a session from the store"""
+        with self._connection:
+            self._connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def close(self):
+        self._connection.close()
+
+
+class SessionManager:
+    """Hands out chat sessions keyed by id, all sharing one bot and its read-only catalog index"""
+
+    def __init__(self, bot: BeautyExpertBot, max_sessions: int = MAX_SESSIONS,
+                 idle_ttl: float = SESSION_IDLE_TTL, store: Optional[SessionStore] = None):
+        """Keep at most max_sessions in memory, evicting least recently used and idle ones
+
+        Evicted sessions are written to store and rehydrated on their next use; without a
+        store they are discarded.
+        """
+        self.bot = bot
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.store = store
+        # session id -> session, least recently used first
+        self.sessions = OrderedDict()
+        self._last_used = {}
+
+    def create_session(self, session_id: Optional[str] = None) -> ChatSession:
+        """Create a new session, replacing any existing session with the same id"""
+        session = ChatSession(self.bot, session_id)
+        if self.store is not None:
+            self.store.delete(session.session_id)
+        self._admit(session)
+        return session
+
+    def get_session(self, session_id: str) -> ChatSession:
+        """Return the session with this id, rehydrating it from the store or creating it if needed"""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self._admit(session)
+            return session
+
+        state = self.store.load(session_id) if self.store is not None else None
+        if state is None:
+            return self.create_session(session_id)
+        session = ChatSession.from_dict(self.bot, session_id, state)
+        self._admit(session)
+        return session
+
+    def end_session(self, session_id: str) -> None:
+        """Drop a session and its history"""
+        self.sessions.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        if self.store is not None:
+            self.store.delete(session_id)
+
+    def evict_idle(self) -> int:
+        """Spill sessions idle for longer than the TTL, returning how many were evicted
+
+        Sessions with a turn or compaction in flight are kept until it finishes.
+        """
+        cutoff = time.monotonic() - self.idle_ttl
+        expired = []
+        for session_id, session in self.sessions.items():
+            if self._last_used[session_id] > cutoff:
+                break
+            if not session.busy:
+                expired.append(session_id)
+        for session_id in expired:
+            self._evict(session_id)
+        return len(expired)
+
+    def flush(self) -> None:
+        """Write every in-memory session to the store, e.g. before shutdown"""
+        if self.store is None:
+            return
+        for session_id, session in self.sessions.items():
+            self.store.save(session_id, session.to_dict())
+
+    def _admit(self, session: ChatSession):
+        """Mark a session as most recently used and enforce the TTL and size limits"""
+        self.sessions[session.session_id] = session
+        self.sessions.move_to_end(session.session_id)
+        self._last_used[session.session_id] = time.monotonic()
+        self.evict_idle()
+        # Busy sessions are skipped, so the limit may be exceeded until their turns finish
+        excess = len(self.sessions) - self.max_sessions
+        if excess > 0:
+            # The session being admitted is about to be returned to the caller, so it always stays
+            idle = [session_id for session_id, other in self.sessions.items()
+                    if session_id != session.session_id and not other.busy]
+            for session_id in idle[:excess]:
+                self._evict(session_id)
+
+    def _evict(self, session_id: str):
+        session = self.sessions.pop(session_id)
+        self._last_used.pop(session_id, None)
+        if self.store is not None:
+            self.store.save(session_id, session.to_dict())
+
+    def __len__(self) -> int:
+        return len(self.sessions)
@@ -0,0 +1,76 @@
+"""Benchmark catalog retrieval quality against embedding dimensionality
+
+text-embedding-3 vectors can be shortened by keeping the leading dimensions and
+re-normalising, which is what the API's dimensions parameter returns. This script does
+that locally on the full-size embedding store, so one set of stored vectors and one
+batch of query embeddings cover every size: recall@k is measured against the full
+1536-dimension ranking for each candidate size.
+"""
+import argparse
+import os
+from typing import Dict, List
+
+import numpy as np
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from beauty_expert_bot import CONCERN_DESCRIPTIONS, EMBEDDING_MODEL, stored_embedding_matrix_path
+from quantization import top_rows
+
+DEFAULT_DIMENSIONS = [128, 256, 512, 768, 1024, 1536]
+
+
+def shorten(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    """Keep the leading dimensions and re-normalise to unit length"""
+    shortened = np.asarray(vectors[..., :dimensions], dtype=np.float32)
+    norms = np.linalg.norm(shortened, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return shortened / norms
+
+
+def dimension_report(matrix: np.ndarray, queries: np.ndarray, dimensions: List[int], top_k: int) -> List[Dict]:
+    """Recall@k of shortened embeddings against the full-size ranking"""
+    full = [set(top_rows(matrix @ query, top_k)) for query in queries]
+    report = []
+    for size in dimensions:
+        shortened_matrix = shorten(matrix, size)
+        shortened_queries = shorten(queries, size)
+        hits = sum(len(truth.intersection(top_rows(shortened_matrix @ query, top_k)))
+                   for query, truth in zip(shortened_queries, full))
+        report.append({"dimensions": size, "recall": hits / (len(queries) * top_k),
+                       "bytes_per_vector": size * 4})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--matrix", default=None,
+                        help="full-size embedding matrix (.npy); defaults to the current embedding store")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=DEFAULT_DIMENSIONS)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--query", action="append", default=[],
+                        help="extra query to evaluate (the concern queries are always included)")
+    args = parser.parse_args()
+    if args.matrix is None:
+        args.matrix = stored_embedding_matrix_path()
+        if args.matrix is None:
+            parser.error("No embedding store found; pass --matrix")
+
+    matrix = np.asarray(np.load(args.matrix, mmap_mode='r'), dtype=np.float32)
+    if matrix.shape[1] < max(args.dimensions):
+        parser.error(f"{args.matrix} holds {matrix.shape[1]}-dimension vectors; build it at full size first")
+
+    load_dotenv()
+    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    texts = list(CONCERN_DESCRIPTIONS.values()) + args.query
+    response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    queries = np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)],
+                       dtype=np.float32)
+
+    print(f"{len(matrix)} products, {len(queries)} queries, recall@{args.top_k} against full size")
+    for row in dimension_report(matrix, queries, args.dimensions, args.top_k):
+        print(f"{row['dimensions']:>5} dims: recall={row['recall']:.3f}  {row['bytes_per_vector']} bytes/vector")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import re
+from functools import reduce
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from lexical_index import tokenize
+
+# A price must carry a currency marker ("$30", "30 dollars") so ages like "over 40" are not read as prices
+_AMOUNT = r"(?:\$\s*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:dollars?|usd|bucks)\b)"
+PRICE_RANGE_PATTERN = re.compile(r"(?:\bbetween\s+)?\$\s*(\d+(?:\.\d+)?)\s*(?:-|to|and)\s*\$?\s*(\d+(?:\.\d+)?)",
+                                 re.IGNORECASE)
+PRICE_MAX_PATTERN = re.compile(r"(?:\b(?:under|below|less than|cheaper than|up to|at most|no more than|max(?:imum)?)\s+"
+                               r"|<\s*)" + _AMOUNT, re.IGNORECASE)
+PRICE_MIN_PATTERN = re.compile(r"(?:\b(?:over|above|more than|at least|min(?:imum)?)\s+|>\s*)" + _AMOUNT, re.IGNORECASE)
+# "no fragrance", "without hyaluronic acid"; up to three words are tried against the ingredient vocabulary
+EXCLUDE_PATTERN = re.compile(r"\b(?:no|without|free of|free from|avoid|avoiding|exclude|excluding)\s+"
+                             r"([a-z]+(?:[\s-]+[a-z]+){0,2})", re.IGNORECASE)
+# "fragrance-free", "alcohol free"
+FREE_PATTERN = re.compile(r"\b([a-z]+)[\s-]free\b", re.IGNORECASE)
+# Longest ingredient name, in tokens, matched after an exclusion keyword
+MAX_INGREDIENT_WORDS = 3
+# A category named in passing ("on my face") is not a constraint; only phrasings that ask for
+# products of the category are: "a (night) serum", "in skincare", "face products". {category}
+# is replaced by the category name.
+CATEGORY_PATTERNS = (
+    r"\b(?:a|an|any|some|only|just)\s+(?:[a-z]+\s+)?{category}\b",
+    r"\b(?:in|from)\s+(?:the\s+)?{category}\b",
+    r"\b{category}\s+(?:category|section|range|products?)\b",
+)
+
+
+def _amount(match: re.Match) -> float:
+    return float(next(group for group in match.groups()[-2:] if group))
+
+
+def _overlaps(span: Tuple[int, int], spans: List[Tuple[int, int]]) -> bool:
+    return any(span[0] < end and start < span[1] for start, end in spans)
+
+
+def _category_key(category) -> str:
+    return " ".join(tokenize(category))
+
+
+def _category_pattern(category_key: str) -> re.Pattern:
+    """Regex matching an explicit request for products of a category, singular or plural"""
+    name = r"\s+".join(re.escape(word) + r"s?" for word in category_key.split())
+    return re.compile("|".join(pattern.format(category=name) for pattern in CATEGORY_PATTERNS), re.IGNORECASE)
+
+
+class ProductFilter:
+    """Structured constraints on the products a search may return"""
+
+    def __init__(self, max_price: Optional[float] = None, min_price: Optional[float] = None,
+                 categories: Iterable[str] = (), exclude_ingredients: Iterable[str] = ()):
+        self.max_price = max_price
+        self.min_price = min_price
+        self.categories = list(categories)
+        self.exclude_ingredients = list(exclude_ingredients)
+
+    def __bool__(self) -> bool:
+        return (self.max_price is not None or self.min_price is not None
+                or bool(self.categories) or bool(self.exclude_ingredients))
+
+    def __repr__(self) -> str:
+        return (f"ProductFilter(max_price={self.max_price!r}, min_price={self.min_price!r}, "
+                f"categories={self.categories!r}, exclude_ingredients={self.exclude_ingredients!r})")
+
+
+class CatalogColumns:
+    """Column arrays over the rows of a catalog snapshot for evaluating filters without touching products
+
+    Prices and categories are dense arrays; each active-ingredient token has a packed bitmap
+    of the rows that contain it, so exclusions are a few byte-wise ORs per query.
+    """
+
+    def __init__(self, prices: np.ndarray, category_codes: np.ndarray, category_index: dict,
+                 ingredient_bitmaps: dict):
+        self.prices = prices
+        self.category_codes = category_codes
+        # Normalised category name -> code in category_codes
+        self.category_index = category_index
+        self.category_patterns = {category: _category_pattern(category) for category in category_index}
+        # Ingredient token -> np.packbits-style bitmap of the rows listing it
+        self.ingredient_bitmaps = ingredient_bitmaps
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    @classmethod
+    def build(cls, products: Iterable) -> 'CatalogColumns':
+        """Build the columns for products (dicts or Product records) in row order"""
+        prices = []
+        category_codes = []
+        category_index = {}
+        ingredient_rows = {}
+        for row, product in enumerate(products):
+            price = product.get('price')
+            prices.append(price if isinstance(price, (int, float)) else np.nan)
+            category = _category_key(product.get('category'))
+            category_codes.append(category_index.setdefault(category, len(category_index)) if category else -1)
+            for token in set(tokenize(product.get('activeContent'))):
+                ingredient_rows.setdefault(token, []).append(row)
+
+        n_bytes = (len(prices) + 7) // 8
+        ingredient_bitmaps = {}
+        for token, rows in ingredient_rows.items():
+            rows = np.array(rows, dtype=np.int64)
+            bitmap = np.zeros(n_bytes, dtype=np.uint8)
+            # Same bit order as np.packbits: row r is bit 7 - r % 8 of byte r // 8
+            np.bitwise_or.at(bitmap, rows >> 3, (0x80 >> (rows & 7)).astype(np.uint8))
+            ingredient_bitmaps[token] = bitmap
+        return cls(np.array(prices, dtype=np.float32), np.array(category_codes, dtype=np.int32),
+                   category_index, ingredient_bitmaps)
+
+    def _known_ingredient(self, words: List[str]) -> bool:
+        tokens = tokenize(" ".join(words))
+        return bool(tokens) and all(token in self.ingredient_bitmaps for token in tokens)
+
+    def parse(self, query: str) -> Tuple[ProductFilter, str]:
+        """Extract price, category and ingredient-exclusion constraints from a query
+
+        Returns the filter and the query with the price and exclusion phrases removed, so
+        that "no fragrance" does not pull fragranced products towards the query. Exclusions
+        are only taken for ingredients the catalog lists. A category is only a constraint when the
+        query asks for products of it (CATEGORY_PATTERNS), and its name is kept in the query.
+        """
+        product_filter = ProductFilter()
+        spans = []
+
+        for match in PRICE_RANGE_PATTERN.finditer(query):
+            low, high = float(match.group(1)), float(match.group(2))
+            product_filter.min_price, product_filter.max_price = min(low, high), max(low, high)
+            spans.append(match.span())
+        for match in PRICE_MAX_PATTERN.finditer(query):
+            if not _overlaps(match.span(), spans):
+                product_filter.max_price = _amount(match)
+                spans.append(match.span())
+        for match in PRICE_MIN_PATTERN.finditer(query):
+            if not _overlaps(match.span(), spans):
+                product_filter.min_price = _amount(match)
+                spans.append(match.span())
+
+        for match in EXCLUDE_PATTERN.finditer(query):
+            words = list(re.finditer(r"[a-z]+", match.group(1), re.IGNORECASE))[:MAX_INGREDIENT_WORDS]
+            for length in range(len(words), 0, -1):
+                span = (match.start(), match.start(1) + words[length - 1].end())
+                if not _overlaps(span, spans) and self._known_ingredient([word.group() for word in words[:length]]):
+                    product_filter.exclude_ingredients.append(
+                        " ".join(word.group().lower() for word in words[:length]))
+                    spans.append(span)
+                    break
+        for match in FREE_PATTERN.finditer(query):
+            if not _overlaps(match.span(), spans) and self._known_ingredient([match.group(1)]):
+                product_filter.exclude_ingredients.append(match.group(1).lower())
+                spans.append(match.span())
+
+        product_filter.categories = [category for category, pattern in self.category_patterns.items()
+                                     if pattern.search(query)]
+
+        remaining = query
+        for start, end in sorted(spans, reverse=True):
+            remaining = remaining[:start] + " " + remaining[end:]
+        return product_filter, " ".join(remaining.split())
+
+    def mask(self, product_filter: Optional[ProductFilter]) -> Optional[np.ndarray]:
+        """Boolean array of the rows satisfying a filter, or None when nothing is constrained
+
+        Rows without a price never satisfy a price constraint.
+        """
+        if not product_filter:
+            return None
+        allowed = np.ones(len(self.prices), dtype=bool)
+        if product_filter.max_price is not None:
+            allowed &= self.prices <= product_filter.max_price
+        if product_filter.min_price is not None:
+            allowed &= self.prices >= product_filter.min_price
+        if product_filter.categories:
+            codes = [self.category_index[key] for key in map(_category_key, product_filter.categories)
+                     if key in self.category_index]
+            allowed &= np.isin(self.category_codes, codes)
+
+        excluded = np.zeros((len(self.prices) + 7) // 8, dtype=np.uint8)
+        for ingredient in product_filter.exclude_ingredients:
+            tokens = tokenize(ingredient)
+            if tokens and all(token in self.ingredient_bitmaps for token in tokens):
+                # A multi-word ingredient excludes the rows that list all of its words
+                excluded |= reduce(np.bitwise_and, (self.ingredient_bitmaps[token] for token in tokens))
+        if excluded.any():
+            allowed &= ~np.unpackbits(excluded, count=len(self.prices)).astype(bool)
+        return allowed
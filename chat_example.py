@@ -1,3 +1,4 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 from beauty_expert_bot import BeautyExpertBot
@@ -34,7 +35,7 @@ def validate_api_key(api_key: str) -> bool:
         return False
     return True
 
-def chat_session():
+async def chat_session():
     # Load OpenAI API key
     load_dotenv()
     api_key = os.getenv('OPENAI_API_KEY')
@@ -47,17 +48,17 @@ def chat_session():
     try:
         # Initialize the beauty expert bot
         print("\nInitializing Beauty Expert Bot...")
-        bot = BeautyExpertBot(api_key)
+        bot = BeautyExpertBot(api_key, query_cache_path='query_cache.npz')
         
         # Start conversation with skin analysis
         print("Starting analysis...")
-        initial_response = bot.start_conversation(SAMPLE_ANALYSIS)
+        initial_response = await bot.start_conversation(SAMPLE_ANALYSIS)
         print(f"\nBeauty Expert: {initial_response}")
 
         # Interactive chat loop
         while True:
             # Get user input
-            user_input = input("\nYou (type 'quit' to end): ").strip()
+            user_input = (await asyncio.to_thread(input, "\nYou (type 'quit' to end): ")).strip()
             
             # Check for exit command
             if user_input.lower() in ['quit', 'exit', 'bye']:
@@ -66,11 +67,14 @@ def chat_session():
                 # Save conversation history
                 filename = bot.save_conversation()
                 print(f"\nConversation saved to: {filename}")
+                bot.query_cache.save()
                 break
             
-            # Get bot's response
-            response = bot.get_response(user_input)
-            print(f"\nBeauty Expert: {response}")
+            # Stream the bot's response as it is generated
+            print("\nBeauty Expert: ", end="", flush=True)
+            async for delta in bot.stream_response(user_input):
+                print(delta, end="", flush=True)
+            print()
 
     except Exception as e:
         print(f"\nError: Failed to initialize or run the chatbot")
@@ -84,4 +88,4 @@ if __name__ == "__main__":
     print("or seek advice about specific skin concerns.")
     print("=" * 50)
     
-    chat_session() 
\ No newline at end of file
+    asyncio.run(chat_session()) 
\ No newline at end of file
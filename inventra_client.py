@@ -0,0 +1,150 @@
+import json
+import threading
+from typing import Dict, Iterable, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+INVENTRA_API_URL = "https://api.inventra.ca/api"
+# (connect, read) timeouts in seconds
+INVENTRA_TIMEOUT = (3.05, 30)
+INVENTRA_MAX_RETRIES = 3
+INVENTRA_POOL_SIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide pooled session for the Inventra API, creating it on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _create_session()
+        return _session
+
+
+def _create_session() -> requests.Session:
+    """Build a keep-alive session that retries transient failures with jittered backoff"""
+    retry = Retry(
+        total=INVENTRA_MAX_RETRIES,
+        backoff_factor=0.5,
+        backoff_jitter=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        # Hand the last response back to the caller instead of raising
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=INVENTRA_POOL_SIZE,
+                          pool_maxsize=INVENTRA_POOL_SIZE)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+    return session
+
+
+def inventra_get(path: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+                 stream: bool = False, timeout=INVENTRA_TIMEOUT) -> requests.Response:
+    """GET an Inventra API path such as "Product/getAllProducts" through the pooled session"""
+    url = f"{INVENTRA_API_URL}/{path.lstrip('/')}"
+    return get_session().get(url, params=params, headers=headers, stream=stream, timeout=timeout)
+
+
+# Characters that may follow a complete JSON value
+VALUE_DELIMITERS = ",]}: \t\r\n"
+
+
+class _JsonStreamReader:
+    """Incremental reader over a stream of JSON text chunks"""
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """Append the next chunk, dropping text already consumed; False at end of stream"""
+        for chunk in self._chunks:
+            if chunk:
+                self.buffer = self.buffer[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of JSON stream")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more chunks until it is available"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+                # A number cut by a chunk boundary ("29." or "1e") decodes as its prefix, so a
+                # value is only complete once a delimiter follows it
+                if (end < len(self.buffer) and self.buffer[end] in VALUE_DELIMITERS) or not self.fill():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    def array_items(self) -> Iterator:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or ']' at offset {self.pos - 1} of JSON stream")
+
+
+def iter_json_array(chunks: Iterable[str], key: Optional[str] = None) -> Iterator:
+    """Yield the items of a JSON array one at a time from a stream of text chunks
+
+    The array is either the whole document or, with key, the value of that key in a
+    top-level object. Only one item is held in memory at a time.
+    """
+    reader = _JsonStreamReader(chunks)
+    if key is None or reader.peek() == "[":
+        yield from reader.array_items()
+        return
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        name = reader.value()
+        reader.expect(":")
+        if name == key:
+            yield from reader.array_items()
+            return
+        # Skip values of other keys
+        reader.value()
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or '}}' at offset {reader.pos - 1} of JSON stream")
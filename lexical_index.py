@@ -0,0 +1,134 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Product fields indexed for keyword search, with the weight of a term occurrence in each
+FIELD_WEIGHTS = {'name': 2.0, 'activeContent': 1.0, 'keyBenefits': 1.0}
+# BM25 term-frequency saturation and document-length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Rank offset of reciprocal rank fusion; larger values flatten the contribution of top ranks
+RRF_K = 60
+# A lexical result is confident when the best product matches every query term and
+# outscores the runner-up by at least this factor
+LEXICAL_CONFIDENCE_MARGIN = 1.5
+
+_STOPWORD_TEXT = """
+    a about an and any are as at be best can could do does for from get give good have help how
+    i im is it its me my need of on or please product products recommend should show some something
+    suggest that the this to use want what which with would you your
+"""
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text) -> List[str]:
+    """Lowercase alphanumeric tokens with simple plural folding"""
+    if text is None:
+        return []
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(item) for item in text)
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(str(text).lower()):
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+# Folded like query tokens, so "this" and "does" are matched as "thi" and "doe"
+STOPWORDS = frozenset(tokenize(_STOPWORD_TEXT))
+
+
+class BM25Index:
+    """In-memory inverted index scoring rows with Okapi BM25
+
+    Rows are numbered in the order the products were given, so they line up with the
+    rows of the embedding matrix the index was built alongside.
+    """
+
+    def __init__(self, postings: Dict[str, Tuple[np.ndarray, np.ndarray]], doc_lengths: np.ndarray):
+        # term -> (rows containing it, weighted term frequency in each)
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        n_docs = len(doc_lengths)
+        self.idf = {term: math.log(1 + (n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                    for term, (rows, _) in postings.items()}
+        # Per-row BM25 length normalisation, fixed for the life of the index
+        self.length_norm = (BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / max(self.avg_doc_length, 1e-9))
+                            ).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, products: Iterable) -> 'BM25Index':
+        """Index the FIELD_WEIGHTS fields of each product (dicts or Product records)"""
+        rows = defaultdict(list)
+        frequencies = defaultdict(list)
+        doc_lengths = []
+        for row, product in enumerate(products):
+            counts = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(product.get(field)):
+                    counts[token] += weight
+            for term, frequency in counts.items():
+                rows[term].append(row)
+                frequencies[term].append(frequency)
+            doc_lengths.append(sum(counts.values()))
+
+        postings = {term: (np.array(rows[term], dtype=np.int32), np.array(frequencies[term], dtype=np.float32))
+                    for term in rows}
+        return cls(postings, np.array(doc_lengths, dtype=np.float32))
+
+    def search(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None,
+               confidence_margin: float = LEXICAL_CONFIDENCE_MARGIN) -> Tuple[np.ndarray, bool]:
+        """Return the rows of the top-k matches, best first, and whether the best is a confident match
+
+        Only the postings of the query terms are read. A match is confident when the best
+        row contains every non-stopword query term and clearly outscores the next row, as
+        for an exact product name or a distinctive ingredient. allowed is an optional boolean
+        mask over the rows; rows outside it are never returned.
+        """
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term not in STOPWORDS]
+        known = [term for term in terms if term in self.postings]
+        if not known:
+            return np.empty(0, dtype=np.int64), False
+
+        # Score only the rows in the query terms' postings; each posting lists a row at most once
+        rows = np.concatenate([self.postings[term][0] for term in known])
+        contributions = np.concatenate([
+            self.idf[term] * self.postings[term][1] * (BM25_K1 + 1)
+            / (self.postings[term][1] + self.length_norm[self.postings[term][0]])
+            for term in known
+        ])
+        candidates, positions = np.unique(rows, return_inverse=True)
+        scores = np.bincount(positions, weights=contributions, minlength=len(candidates))
+        matched = np.bincount(positions, minlength=len(candidates))
+
+        if allowed is not None:
+            keep = allowed[candidates]
+            candidates, scores, matched = candidates[keep], scores[keep], matched[keep]
+        if not len(candidates):
+            return np.empty(0, dtype=np.int64), False
+        top_k = min(top_k, len(candidates))
+        best = np.argpartition(scores, -top_k)[-top_k:]
+        best = best[np.argsort(scores[best])[::-1]]
+
+        confident = len(known) == len(terms) and matched[best[0]] == len(terms) \
+            and (len(candidates) == 1 or (len(best) > 1 and scores[best[0]] >= confidence_margin * scores[best[1]]))
+        return candidates[best].astype(np.int64), bool(confident)
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], top_k: int, k: int = RRF_K) -> np.ndarray:
+    """Merge several best-first row rankings, scoring each row by the sum of 1 / (k + rank)"""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, 1):
+            fused[int(row)] += 1.0 / (k + rank)
+    best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return np.array(best, dtype=np.int64)
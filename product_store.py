@@ -0,0 +1,229 @@
+import json
+import sqlite3
+import sys
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Fields read on every search and recommendation; everything else stays on disk
+HOT_FIELDS = ('id', 'name', 'keyBenefits', 'activeContent', 'price', 'category')
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Product:
+    """Compact product record holding only the hot fields in memory
+
+    Long, rarely used fields such as description and howToUse are read from the product
+    store on access. Dict-style access (product['name'], product.get(...)) is supported
+    so records can be used wherever catalog dicts were.
+    """
+
+    __slots__ = ('id', 'name', 'keyBenefits', 'activeContent', 'price', 'category',
+                 'text_hash', '_store', '_ref')
+
+    def __init__(self, data: Dict, text_hash: Optional[str] = None, store=None, ref=None):
+        # Ids are normalised to str, matching the ids of the embedding store
+        self.id = sys.intern(str(data['id']))
+        self.name = _intern(data.get('name'))
+        self.keyBenefits = _intern(data.get('keyBenefits'))
+        self.activeContent = _intern(data.get('activeContent'))
+        self.price = data.get('price')
+        self.category = _intern(data.get('category'))
+        self.text_hash = text_hash
+        self._store = store
+        self._ref = ref
+
+    def details(self) -> Dict:
+        """Return the full product record from the store
+
+        A product removed by a later sync is no longer in the store; older catalog snapshots
+        may still hold its record, so only its hot fields are returned then.
+        """
+        if self._store is None:
+            return self.to_hot_dict()
+        try:
+            return self._store.load_details(self._ref)
+        except KeyError:
+            return self.to_hot_dict()
+
+    def to_hot_dict(self) -> Dict:
+        return {field: getattr(self, field) for field in HOT_FIELDS}
+
+    def __getitem__(self, key: str):
+        if key in HOT_FIELDS:
+            return getattr(self, key)
+        return self.details()[key]
+
+    def get(self, key: str, default=None):
+        if key in HOT_FIELDS:
+            return getattr(self, key)
+        return self.details().get(key, default)
+
+    def __repr__(self) -> str:
+        return f"Product(id={self.id!r}, name={self.name!r})"
+
+
+class SqliteProductStore:
+    """Local product store in an indexed SQLite database
+
+    Only the hot columns are read at startup; full records are fetched by id on demand.
+    Syncs are applied as upserts in one transaction, and the database runs in WAL mode so
+    several processes can read it while one writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS products (
+                    id TEXT PRIMARY KEY,
+                    name TEXT,
+                    price REAL,
+                    category TEXT,
+                    key_benefits TEXT,
+                    active_content TEXT,
+                    description TEXT,
+                    how_to_use TEXT,
+                    data TEXT NOT NULL,
+                    content_hash TEXT,
+                    embedding BLOB,
+                    sync_id INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS products_price ON products (price);
+                CREATE INDEX IF NOT EXISTS products_category ON products (category);
+                CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT);
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            self._local.connection = connection
+        return connection
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """Return a value from the store's key/value metadata"""
+        row = self._connection().execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        """Set a value in the store's key/value metadata"""
+        with self._connection() as connection:
+            self._set_meta(connection, key, value)
+
+    @staticmethod
+    def _set_meta(connection: sqlite3.Connection, key: str, value: str):
+        connection.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, value))
+
+    def load(self, text_hash: Callable[[Dict], str], hash_version: str) -> List[Product]:
+        """Read the hot columns of every product; raises FileNotFoundError if the store is empty
+
+        Content hashes are recomputed from the full records if they were written under a
+        different hash_version (for example another embedding model).
+        """
+        if self.get_meta('sync_id') is None:
+            raise FileNotFoundError(f"No products synced to {self.path}")
+        if self.get_meta('hash_version') != hash_version:
+            self._rehash(text_hash, hash_version)
+
+        rows = self._connection().execute(
+            "SELECT id, name, key_benefits, active_content, price, category, content_hash FROM products"
+        )
+        return [
+            Product({'id': row[0], 'name': row[1], 'keyBenefits': row[2], 'activeContent': row[3],
+                     'price': row[4], 'category': row[5]}, row[6], self, row[0])
+            for row in rows
+        ]
+
+    def _rehash(self, text_hash: Callable[[Dict], str], hash_version: str):
+        with self._connection() as connection:
+            rows = connection.execute("SELECT id, data FROM products").fetchall()
+            connection.executemany(
+                "UPDATE products SET content_hash = ?, embedding = NULL WHERE id = ?",
+                [(text_hash(json.loads(data)), product_id) for product_id, data in rows]
+            )
+            self._set_meta(connection, 'hash_version', hash_version)
+
+    def write(self, records: Iterable[Dict], text_hash: Callable[[Dict], str], hash_version: str,
+              batch_size: int = 500) -> List[Product]:
+        """Upsert records as they arrive and delete products missing from this sync
+
+        The whole sync is one transaction, so readers see either the old or the new catalog.
+        A product's stored embedding is kept only while its content hash is unchanged.
+        """
+        products = []
+        with self._connection() as connection:
+            sync_id = int(self.get_meta('sync_id') or 0) + 1
+            batch = []
+            for data in records:
+                product = Product(data, text_hash(data), self, str(data['id']))
+                products.append(product)
+                batch.append((product.id, product.name, product.price, product.category, product.keyBenefits,
+                              product.activeContent, data.get('description'), data.get('howToUse'),
+                              json.dumps(data), product.text_hash, sync_id))
+                if len(batch) >= batch_size:
+                    self._upsert(connection, batch)
+                    batch = []
+            self._upsert(connection, batch)
+            connection.execute("DELETE FROM products WHERE sync_id != ?", (sync_id,))
+            self._set_meta(connection, 'sync_id', str(sync_id))
+            self._set_meta(connection, 'hash_version', hash_version)
+        return products
+
+    @staticmethod
+    def _upsert(connection: sqlite3.Connection, batch: List[Tuple]):
+        connection.executemany("""
+            INSERT INTO products (id, name, price, category, key_benefits, active_content,
+                                  description, how_to_use, data, content_hash, sync_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                name = excluded.name, price = excluded.price, category = excluded.category,
+                key_benefits = excluded.key_benefits, active_content = excluded.active_content,
+                description = excluded.description, how_to_use = excluded.how_to_use,
+                data = excluded.data, sync_id = excluded.sync_id,
+                embedding = CASE WHEN content_hash = excluded.content_hash THEN embedding END,
+                content_hash = excluded.content_hash
+        """, batch)
+
+    def load_details(self, product_id: str) -> Dict:
+        """Return the full record of a product"""
+        row = self._connection().execute("SELECT data FROM products WHERE id = ?", (product_id,)).fetchone()
+        if row is None:
+            raise KeyError(product_id)
+        return json.loads(row[0])
+
+    def ids_by_price(self, max_price: Optional[float] = None, min_price: Optional[float] = None) -> List[str]:
+        """Return the ids of products within a price range, using the price index"""
+        rows = self._connection().execute(
+            "SELECT id FROM products WHERE price BETWEEN ? AND ?",
+            (min_price if min_price is not None else float('-inf'),
+             max_price if max_price is not None else float('inf'))
+        )
+        return [row[0] for row in rows]
+
+    def load_embeddings(self, product_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return the stored float32 embeddings of the given products, skipping missing ones"""
+        embeddings = {}
+        connection = self._connection()
+        for product_id in product_ids:
+            row = connection.execute("SELECT embedding FROM products WHERE id = ? AND embedding IS NOT NULL",
+                                     (product_id,)).fetchone()
+            if row is not None:
+                embeddings[product_id] = np.frombuffer(row[0], dtype=np.float32)
+        return embeddings
+
+    def save_embeddings(self, embeddings: Dict[str, List[float]]):
+        """Store embeddings for products whose text was just embedded"""
+        with self._connection() as connection:
+            connection.executemany(
+                "UPDATE products SET embedding = ? WHERE id = ?",
+                [(np.asarray(embedding, dtype=np.float32).tobytes(), product_id)
+                 for product_id, embedding in embeddings.items()]
+            )
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+QUANTIZATION_KINDS = ('float16', 'int8')
+# Rows dequantized per block while scoring, bounding temporary float32 memory
+SCORE_BLOCK_ROWS = 16384
+
+
+class QuantizedMatrix:
+    """Reduced-precision copy of an embedding matrix that is scored without a float32 copy
+
+    float16 halves the size of every row. int8 stores each row as signed bytes with one
+    float32 scale per row (row ≈ codes * scale), a quarter of the float32 size.
+    """
+
+    def __init__(self, kind: str, codes: np.ndarray, scales: Optional[np.ndarray] = None, fingerprint: str = ""):
+        if kind not in QUANTIZATION_KINDS:
+            raise ValueError(f"Unknown quantization {kind!r}, expected one of {QUANTIZATION_KINDS}")
+        self.kind = kind
+        self.codes = codes
+        self.scales = scales
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray, kind: str, fingerprint: str = "") -> 'QuantizedMatrix':
+        if kind == 'float16':
+            return cls(kind, np.asarray(matrix, dtype=np.float16), fingerprint=fingerprint)
+        matrix = np.asarray(matrix, dtype=np.float32)
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.round(matrix / scales[:, None]).astype(np.int8)
+        return cls(kind, codes, scales.astype(np.float32), fingerprint)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def score(self, query: np.ndarray) -> np.ndarray:
+        """Similarity of every row to the query"""
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_BLOCK_ROWS):
+            stop = min(start + SCORE_BLOCK_ROWS, len(self.codes))
+            scores[start:stop] = self._score_block(slice(start, stop), query)
+        return scores
+
+    def score_rows(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Similarity of the given rows to the query"""
+        return self._score_block(rows, query)
+
+    def _score_block(self, rows, query: np.ndarray) -> np.ndarray:
+        scores = self.codes[rows].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[rows]
+        return scores
+
+    def save(self, path: str):
+        """Write <path>.npy (codes), <path>.scales.npy for int8, and a <path>.json sidecar"""
+        files = {f"{path}.npy": self.codes}
+        if self.scales is not None:
+            files[f"{path}.scales.npy"] = self.scales
+        for file_path, array in files.items():
+            with open(f"{file_path}.tmp", 'wb') as f:
+                np.save(f, array)
+            os.replace(f"{file_path}.tmp", file_path)
+        with open(f"{path}.json.tmp", 'w') as f:
+            json.dump({"kind": self.kind, "fingerprint": self.fingerprint}, f)
+        os.replace(f"{path}.json.tmp", f"{path}.json")
+
+    @classmethod
+    def load(cls, path: str) -> 'QuantizedMatrix':
+        """Memory-map a saved matrix; raises FileNotFoundError if there is none"""
+        with open(f"{path}.json", 'r') as f:
+            meta = json.load(f)
+        codes = np.load(f"{path}.npy", mmap_mode='r')
+        scales = np.load(f"{path}.scales.npy", mmap_mode='r') if meta['kind'] == 'int8' else None
+        return cls(meta['kind'], codes, scales, meta.get('fingerprint', ""))
+
+
+def top_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top-k scores, best first"""
+    top_k = min(top_k, len(scores))
+    best = np.argpartition(scores, -top_k)[-top_k:]
+    return best[np.argsort(scores[best])[::-1]]
+
+
+def rerank(matrix: np.ndarray, candidates: np.ndarray, query: np.ndarray, top_k: int) -> np.ndarray:
+    """Re-score candidate rows with the full-precision matrix and keep the exact top-k"""
+    candidates = np.sort(candidates)
+    return candidates[top_rows(np.asarray(matrix[candidates], dtype=np.float32) @ query, top_k)]
+
+
+def recall_report(matrix: np.ndarray, queries: np.ndarray, top_k: int = 10, rerank_factor: int = 4) -> List[Dict]:
+    """Recall@k of each quantization against float32 search, with and without re-ranking"""
+    exact = [set(top_rows(matrix @ query, top_k)) for query in queries]
+    report = []
+    for kind in QUANTIZATION_KINDS:
+        quantized = QuantizedMatrix.from_matrix(matrix, kind)
+        for factor in (1, rerank_factor):
+            hits = 0
+            for query, truth in zip(queries, exact):
+                candidates = top_rows(quantized.score(query), top_k * factor)
+                if factor > 1:
+                    candidates = rerank(matrix, candidates, query, top_k)
+                hits += len(truth.intersection(candidates))
+            report.append({"kind": kind, "rerank_candidates": top_k * factor if factor > 1 else 0,
+                           "recall": hits / (len(queries) * top_k),
+                           "bytes_per_vector": quantized.nbytes / len(matrix)})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report recall of quantized embedding search on the embedding store")
+    parser.add_argument("--matrix", default=None,
+                        help="embedding matrix (.npy); defaults to the current embedding store")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.02, help="query perturbation per dimension")
+    args = parser.parse_args()
+    if args.matrix is None:
+        # Imported here: the bot module itself imports this one
+        from beauty_expert_bot import stored_embedding_matrix_path
+        args.matrix = stored_embedding_matrix_path()
+        if args.matrix is None:
+            parser.error("No embedding store found; pass --matrix")
+
+    matrix = np.asarray(np.load(args.matrix, mmap_mode='r'), dtype=np.float32)
+    rng = np.random.default_rng(1)
+    queries = matrix[rng.choice(len(matrix), min(args.queries, len(matrix)), replace=False)]
+    queries = queries + rng.normal(scale=args.noise, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(f"float32: {matrix.shape[1] * 4} bytes/vector")
+    for row in recall_report(matrix, queries, args.top_k):
+        rerank_note = f"rerank {row['rerank_candidates']}" if row['rerank_candidates'] else "no rerank"
+        print(f"{row['kind']:>8} ({rerank_note:>10}): recall@{args.top_k}={row['recall']:.3f}  "
+              f"{row['bytes_per_vector']:.0f} bytes/vector")
+
+
+if __name__ == "__main__":
+    main()